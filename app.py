@@ -1,12 +1,64 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-from supabase import create_client, Client
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import contextlib
+import csv
+import functools
+import hashlib
+import io
 import os
 import json
+import re
+import time
 import uuid
-import requests
 import threading
+import direct_db
+
+# Startup profiling (STARTUP_PROFILE=true): logs import/init time per step and the
+# time to the first successful responses, measured from process start, and adds them
+# to /api/health. For a per-module import breakdown use python -X importtime.
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', 'False').lower() == 'true'
+
+_startup_timings = {}
+
+
+def process_started():
+    """time.perf_counter() value at which this process started.
+
+    Read from /proc/self/stat (Linux, 10 ms resolution); elsewhere falls back to now,
+    so timings are measured from app import instead.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+        return time.perf_counter() - age
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.perf_counter()
+
+
+_process_started = process_started()
+
+
+def record_startup(name, started):
+    """Record (once) how long a startup step took, in milliseconds"""
+    if name in _startup_timings:
+        return
+    _startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    if STARTUP_PROFILE:
+        print(f"[STARTUP] {name}: {_startup_timings[name]} ms")
+
+
+@contextlib.contextmanager
+def startup_timer(name):
+    """Time a block (an import or client construction) for the startup profile"""
+    started = time.perf_counter()
+    yield
+    record_startup(name, started)
+
+
+record_startup('process start to app imports', _process_started)
 
 app = Flask(__name__)
 
@@ -14,8 +66,9 @@ app = Flask(__name__)
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key", "If-Match"],
+        "expose_headers": ["ETag", "Idempotent-Replayed"]
     }
 })
 
@@ -26,13 +79,210 @@ SUPABASE_KEY = os.environ.get('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXV
 # n8n webhook URL for AI processing (production webhook)
 N8N_WEBHOOK_URL = os.environ.get('N8N_WEBHOOK_URL', 'https://slipstreamaiconsulting.app.n8n.cloud/webhook/vrdcrashworkflow')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Cold storage: reviewed reports older than the cutoff move to reports_archive
+ARCHIVE_CUTOFF_DAYS = int(os.environ.get('ARCHIVE_CUTOFF_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 100))
+# Batches per POST /api/archive/run, to stay well inside the gunicorn timeout
+ARCHIVE_MAX_BATCHES_PER_REQUEST = int(os.environ.get('ARCHIVE_MAX_BATCHES_PER_REQUEST', 5))
+
+# Idempotency-Key dedup store (per worker): bounded, entries expire after the TTL
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', 1000))
+
+# Hot reads (report lists and details): 'supabase' (PostgREST) or 'postgres' (direct_db pool)
+READ_BACKEND = os.environ.get('READ_BACKEND', 'supabase').lower()
+
+# Built lazily, once per worker process (see get_supabase)
+_supabase = None
+_supabase_pid = None
+_supabase_lock = threading.Lock()
+
+# Raw AI agent output: report JSON between markers, incident_id anywhere in the message
+JSON_START_MARKER = '###JSON_START###'
+JSON_END_MARKER = '###JSON_END###'
+INCIDENT_ID_PATTERN = re.compile(r'VRD-\d{8}-[A-F0-9]{6}', re.IGNORECASE)
+AI_MESSAGE_KEYS = ('output', 'message', 'text', 'response')
+
+# Optimistic concurrency: every report write bumps reports.version (exposed as the ETag)
+REPORT_FIELDS = ('driver', 'date', 'chassis', 'event', 'accident_damage')
+PART_FIELDS = ('part_number', 'part', 'likelihood', 'price', 'qty')
+PART_DEFAULTS = {'part_number': '', 'part': '', 'likelihood': 'Possible', 'price': 0.0, 'qty': 1}
+VALID_STATUSES = ('pending', 'active', 'reviewed')
+
+# PostgREST/Postgres errors meaning supabase_migrations.sql has not been applied
+SCHEMA_ERROR_CODES = ('PGRST202', '42883', '42703')
+
+
+def get_supabase():
+    """Supabase client for this worker process, created on first use.
+
+    The supabase package and its dependencies are only imported here, so importing the
+    app stays cheap. A client inherited across a fork (gunicorn --preload) is rebuilt.
+    """
+    global _supabase, _supabase_pid
+    if _supabase is None or _supabase_pid != os.getpid():
+        with _supabase_lock:
+            if _supabase is None or _supabase_pid != os.getpid():
+                with startup_timer('supabase (import)'):
+                    from supabase import create_client
+                with startup_timer('supabase (create_client)'):
+                    _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                _supabase_pid = os.getpid()
+    return _supabase
+
+
+def warm_up():
+    """Import the heavy client libraries ahead of the first request.
+
+    Safe to call before forking (gunicorn --preload): only modules are loaded, so the
+    workers share them, and each worker still builds its own Supabase client. Opt-in
+    (WARM_UP_IN_MASTER), since it delays the workers and the first health check.
+    """
+    with startup_timer('supabase (import)'):
+        import supabase  # noqa: F401
+    with startup_timer('requests'):
+        import requests  # noqa: F401
+
+
+def init_worker():
+    """Build this worker's clients in the background, so health checks answer at once"""
+    def build_client():
+        try:
+            get_supabase()
+            if READ_BACKEND == 'postgres':
+                with startup_timer('postgres pool (open)'):
+                    direct_db.get_pool()
+        except Exception as e:
+            print(f"[STARTUP] ERROR - Failed to initialise database clients: {str(e)}")
+
+    thread = threading.Thread(target=build_client)
+    thread.daemon = True
+    thread.start()
+
+
+_idempotency_store = OrderedDict()
+_idempotency_lock = threading.Lock()
+
+
+def idempotent(view):
+    """Replay the stored response when a request repeats its Idempotency-Key.
+
+    Keys are scoped to method and path, and only successful (2xx) responses are
+    kept (body, status and headers such as ETag), so a failed request can be
+    retried with the same key. A repeat while the first request is still running
+    gets 409; reusing a key with a different body gets 422. The store is per
+    worker process; see insert_report_once for cross-worker report creation.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+
+        store_key = (request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        now = time.monotonic()
+
+        with _idempotency_lock:
+            # Entries share one TTL, so the oldest are always at the front
+            while _idempotency_store:
+                oldest = next(iter(_idempotency_store.values()))
+                if oldest['expires'] > now:
+                    break
+                _idempotency_store.popitem(last=False)
+
+            entry = _idempotency_store.get(store_key)
+            if entry:
+                if entry['fingerprint'] != fingerprint:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Idempotency-Key was already used with a different request body'
+                    }), 422
+                if entry['response'] is None:
+                    return jsonify({
+                        'success': False,
+                        'error': 'A request with this Idempotency-Key is still being processed'
+                    }), 409
+                body, status, mimetype, headers = entry['response']
+                print(f"[IDEMPOTENCY] Replaying stored response for key {key}")
+                response = app.response_class(body, status=status, mimetype=mimetype, headers=headers)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            _idempotency_store[store_key] = {
+                'fingerprint': fingerprint,
+                'expires': now + IDEMPOTENCY_TTL_SECONDS,
+                'response': None
+            }
+            while len(_idempotency_store) > IDEMPOTENCY_MAX_KEYS:
+                _idempotency_store.popitem(last=False)
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            with _idempotency_lock:
+                _idempotency_store.pop(store_key, None)
+            raise
+
+        with _idempotency_lock:
+            if 200 <= response.status_code < 300 and store_key in _idempotency_store:
+                headers = [(name, value) for name, value in response.headers
+                           if name not in ('Content-Type', 'Content-Length')]
+                _idempotency_store[store_key]['response'] = (
+                    response.get_data(), response.status_code, response.mimetype, headers
+                )
+            else:
+                _idempotency_store.pop(store_key, None)
+
+        return response
+
+    return wrapper
+
+
+def insert_report_once(report_data):
+    """Insert a report row, at most once per Idempotency-Key across all workers.
+
+    The key (scoped to the path) is stored in the unique reports.idempotency_key column and
+    the insert skips conflicts, so if another worker already created the report for this
+    key, nothing is inserted. Returns (report, created); an existing report comes back
+    with its parts embedded.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return get_supabase().table('reports').insert(report_data).execute().data[0], True
+
+    scoped_key = f'{request.path} {key}'
+    response = get_supabase().table('reports').upsert(
+        {**report_data, 'idempotency_key': scoped_key},
+        on_conflict='idempotency_key',
+        ignore_duplicates=True
+    ).execute()
+    if response.data:
+        return response.data[0], True
+
+    print(f"[IDEMPOTENCY] Report for key {key} was already created by another worker")
+    response = get_supabase().table('reports').select('*,parts(*)').eq('idempotency_key', scoped_key).execute()
+    return response.data[0], False
+
+
+def replayed_report_response(report, message, **extra):
+    """201 response repeating a report that an earlier request with the same key created"""
+    response = jsonify({
+        'success': True,
+        'message': message,
+        'report': report_to_dict(report, embedded_parts(report)),
+        **extra
+    })
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, 201
 
 
 def trigger_n8n_workflow(report_data):
     """Trigger n8n webhook to process crash report with AI (runs in background)"""
     def send_webhook():
         try:
+            with startup_timer('requests'):
+                import requests
             print(f"[WEBHOOK] Triggering n8n webhook at: {N8N_WEBHOOK_URL}")
             print(f"[WEBHOOK] Sending data for incident: {report_data.get('incident_id')}")
             response = requests.post(
@@ -69,6 +319,7 @@ def report_to_dict(report, parts=None):
         'status': report.get('status', 'pending'),
         'created_at': report.get('created_at'),
         'updated_at': report.get('updated_at'),
+        'version': report.get('version'),
         'parts': parts if parts is not None else []
     }
 
@@ -88,15 +339,286 @@ def part_to_dict(part):
 
 
 def get_report_with_parts(report_id):
-    """Get a report with its parts"""
-    report_response = supabase.table('reports').select('*').eq('id', report_id).single().execute()
-    if not report_response.data:
+    """Get a report with its parts (one query on either read backend)"""
+    if READ_BACKEND == 'postgres':
+        row = direct_db.fetch_report(report_id)
+    else:
+        row = fetch_report_row(report_id, include_parts=True)
+    if not row:
         return None
+    return report_to_dict(row, embedded_parts(row))
+
+
+def list_reports_with_parts(status=None):
+    """Get reports, newest first, with their parts (one query on either read backend)"""
+    if READ_BACKEND == 'postgres':
+        rows = direct_db.fetch_reports(status)
+    else:
+        query = get_supabase().table('reports').select('*,parts(*)')
+        if status:
+            query = query.eq('status', status)
+        rows = query.order('created_at', desc=True).execute().data or []
+    return [report_to_dict(row, embedded_parts(row)) for row in rows]
+
+
+def archived_report_to_dict(row):
+    """Convert a reports_archive row (parts stored inline) to dictionary format"""
+    parts = row.get('parts') or []
+    if isinstance(parts, str):
+        parts = json.loads(parts)
+    report = report_to_dict(row, [part_to_dict(p) for p in parts])
+    report['archived_at'] = row.get('archived_at')
+    return report
+
+
+def archive_reviewed_reports(cutoff_days=None, max_batches=None):
+    """Move reviewed reports older than the cutoff, with their parts, into reports_archive.
+
+    Each batch is moved by the archive_reviewed_reports database function, which copies
+    and deletes in one statement, so a report edited mid-run is never lost. Stops after
+    max_batches batches (None for no limit); 'complete' is False if more may remain.
+    """
+    if cutoff_days is None:
+        cutoff_days = ARCHIVE_CUTOFF_DAYS
+    cutoff = (datetime.utcnow() - timedelta(days=cutoff_days)).isoformat() + '+00:00'
+    archived = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        response = get_supabase().rpc('archive_reviewed_reports', {
+            'p_cutoff': cutoff,
+            'p_limit': ARCHIVE_BATCH_SIZE
+        }).execute()
+        moved = response.data or 0
+        batches += 1
+        archived += moved
+        if moved:
+            print(f"[ARCHIVE] Moved {moved} reviewed reports to cold storage (total {archived})")
+
+        if moved < ARCHIVE_BATCH_SIZE:
+            return {'archived': archived, 'cutoff': cutoff, 'complete': True}
+
+    return {'archived': archived, 'cutoff': cutoff, 'complete': False}
+
+
+def normalize_part(part):
+    """Coerce an AI-generated part to the fields and types the parts table expects"""
+    try:
+        price = float(part.get('price', 0) or 0)
+    except (TypeError, ValueError):
+        price = 0.0
+    try:
+        qty = int(part.get('qty', 1) or 1)
+    except (TypeError, ValueError):
+        qty = 1
+    return {
+        'part_number': part.get('part_number') or '',
+        'part': part.get('part') or '',
+        'likelihood': part.get('likelihood') or 'Possible',
+        'price': price,
+        'qty': qty
+    }
 
-    parts_response = supabase.table('parts').select('*').eq('report_id', report_id).execute()
-    parts = [part_to_dict(p) for p in (parts_response.data or [])]
 
-    return report_to_dict(report_response.data, parts)
+def extract_ai_message(payload):
+    """Find the AI agent's message text in an n8n item, a JSON string or a raw body"""
+    if isinstance(payload, list) and payload:
+        payload = payload[0]
+    if isinstance(payload, dict):
+        payload = payload.get('json', payload)
+    if isinstance(payload, dict):
+        for key in AI_MESSAGE_KEYS:
+            if payload.get(key):
+                return str(payload[key])
+    if isinstance(payload, str):
+        return payload
+    return json.dumps(payload) if payload is not None else ''
+
+
+def parse_ai_report(message):
+    """Extract, validate and normalise the crash report from a raw AI message.
+
+    Returns (report_data, incident_id); raises ValueError if the message holds no
+    complete report.
+    """
+    start_index = message.find(JSON_START_MARKER)
+    end_index = message.find(JSON_END_MARKER, start_index + 1) if start_index != -1 else -1
+    if start_index == -1 or end_index == -1:
+        raise ValueError('JSON markers not found in AI response. The AI may not have generated '
+                         'a final report yet, or the format is incorrect.')
+
+    try:
+        report_data = json.loads(message[start_index + len(JSON_START_MARKER):end_index])
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Invalid report JSON between markers: {e}')
+    if isinstance(report_data, str):
+        report_data = json.loads(report_data)
+    if not isinstance(report_data, dict):
+        raise ValueError('Report JSON must be an object')
+
+    for field in ('driver', 'date', 'event'):
+        if not report_data.get(field):
+            raise ValueError(f'Missing required field: {field}')
+
+    incident_id = report_data.get('incident_id')
+    if incident_id and not isinstance(incident_id, str):
+        raise ValueError('incident_id must be a string')
+    if not incident_id:
+        incident_match = INCIDENT_ID_PATTERN.search(message)
+        incident_id = incident_match.group(0) if incident_match else None
+    if incident_id:
+        incident_id = incident_id.upper()
+
+    parts = report_data.get('parts') or []
+    if isinstance(parts, str):
+        parts = json.loads(parts)
+    if not isinstance(parts, list) or not all(isinstance(p, dict) for p in parts):
+        raise ValueError('parts must be a list of objects')
+
+    return {
+        'driver': report_data['driver'],
+        'date': report_data['date'],
+        'chassis': report_data.get('chassis') or '',
+        'event': report_data['event'],
+        'accident_damage': report_data.get('accident_damage') or '',
+        'parts': [normalize_part(p) for p in parts]
+    }, incident_id
+
+
+def parse_part_fields(data):
+    """Validate the part fields present in user input (edit UI / API).
+
+    Unlike normalize_part, which is for AI output, an invalid price or qty is an error
+    rather than a default. Missing or empty values still fall back to the defaults.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Each part must be an object')
+    fields = {}
+    for field in PART_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == 'price':
+            value = float(value or 0)
+        elif field == 'qty':
+            value = int(value or 1)
+        elif value is None:
+            value = PART_DEFAULTS[field]
+        fields[field] = value
+    return fields
+
+
+def parse_part(data):
+    """Validate a complete part from user input, filling in defaults"""
+    return {**PART_DEFAULTS, **parse_part_fields(data)}
+
+
+def report_etag(report):
+    """ETag for a report - its version number, quoted (None before the version migration)"""
+    if report.get('version') is None:
+        return None
+    return f'"{report["version"]}"'
+
+
+def set_etag(response, report):
+    """Add the report's ETag to a response, if it has one"""
+    etag = report_etag(report)
+    if etag:
+        response.headers['ETag'] = etag
+    return response
+
+
+def get_if_match_version():
+    """Version from the If-Match header; None when absent or '*'. Raises ValueError if malformed."""
+    if_match = request.headers.get('If-Match', '').strip()
+    if not if_match or if_match == '*':
+        return None
+    if if_match.startswith('W/'):
+        if_match = if_match[2:]
+    try:
+        return int(if_match.strip('"'))
+    except ValueError:
+        raise ValueError(f'Invalid If-Match header: {if_match}')
+
+
+def fetch_report_row(report_id, include_parts=False):
+    """Get a raw report row (optionally with its parts embedded), or None"""
+    query = get_supabase().table('reports').select('*,parts(*)' if include_parts else '*').eq('id', report_id)
+    response = query.execute()
+    return response.data[0] if response.data else None
+
+
+def embedded_parts(row):
+    """Parts embedded in a report row, in dictionary format"""
+    return [part_to_dict(p) for p in sorted(row.get('parts') or [], key=lambda p: p['id'])]
+
+
+def save_report(report_id=None, if_match=None, fields=None, parts=None, part_changes=None,
+                part_deletes=None, incident_id=None, part_id=None):
+    """Apply a report edit atomically through the save_report database function.
+
+    The version check, part changes (parts replaces the whole list; part_changes updates
+    parts by id or inserts new ones; part_deletes removes parts) and the recomputed total
+    are one transaction under a lock on the report row, so concurrent edits queue rather
+    than overwrite each other. The report is given by id, or found by incident_id or by
+    one of its parts (part_id) inside the same call. With If-Match, a stale version fails
+    with 412. Returns (result, error_response); result holds the saved 'report' with its
+    parts embedded and the 'changed_parts'.
+    """
+    try:
+        response = get_supabase().rpc('save_report', {
+            'p_report_id': report_id,
+            'p_expected_version': if_match,
+            'p_fields': fields or {},
+            'p_parts': parts,
+            'p_part_changes': part_changes or [],
+            'p_part_deletes': part_deletes or [],
+            'p_incident_id': incident_id,
+            'p_part_id': part_id
+        }).execute()
+    except Exception as e:
+        if getattr(e, 'code', None) in SCHEMA_ERROR_CODES:
+            return None, schema_error_response(e)
+        raise
+
+    result = response.data
+    error = result.get('error')
+    if error == 'not_found':
+        if incident_id:
+            message = f'Report with incident_id {incident_id} not found'
+        else:
+            message = 'Report not found'
+        return None, (jsonify({'success': False, 'error': message}), 404)
+    if error == 'part_not_found':
+        return None, (jsonify({'success': False, 'error': f"Part {result['part_id']} not found"}), 404)
+    if error == 'version_conflict':
+        response = jsonify({
+            'success': False,
+            'error': 'Report has been modified by someone else. Reload and try again.',
+            'version': result['version']
+        })
+        return None, (set_etag(response, result), 412)
+    return result, None
+
+
+def schema_error_response(error):
+    """500 response when the database is missing supabase_migrations.sql"""
+    print(f"[SCHEMA] ERROR - Database schema is out of date, run supabase_migrations.sql: {error}")
+    return jsonify({
+        'success': False,
+        'error': 'Database schema is out of date: run supabase_migrations.sql'
+    }), 500
+
+
+def saved_report_to_dict(result):
+    """Report dictionary from a save_report result"""
+    return report_to_dict(result['report'], embedded_parts(result['report']))
+
+
+def report_response(report, message, status_code=200):
+    """Standard success response for a report write, with the new ETag"""
+    response = jsonify({'success': True, 'message': message, 'report': report})
+    return set_etag(response, report), status_code
 
 
 # Web Routes
@@ -141,19 +663,27 @@ def n8n_integration_page():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'message': 'VRD Crash Calculator API is running'}), 200
+    health = {'status': 'healthy', 'message': 'VRD Crash Calculator API is running'}
+    if STARTUP_PROFILE:
+        health['startup_ms'] = _startup_timings
+    return jsonify(health), 200
+
+
+@app.after_request
+def record_first_responses(response):
+    """Startup profile: time from app import to the first successful health check and real request"""
+    if STARTUP_PROFILE and response.status_code < 400:
+        if request.path == '/api/health':
+            record_startup('first /api/health', _process_started)
+        elif request.path.startswith('/api/'):
+            record_startup('first API request', _process_started)
+    return response
 
 
 @app.route('/api/reports', methods=['GET'])
 def get_reports():
     """Get all reports"""
-    response = supabase.table('reports').select('*').order('created_at', desc=True).execute()
-    reports = []
-    for report in (response.data or []):
-        parts_response = supabase.table('parts').select('*').eq('report_id', report['id']).execute()
-        parts = [part_to_dict(p) for p in (parts_response.data or [])]
-        reports.append(report_to_dict(report, parts))
-    return jsonify(reports), 200
+    return jsonify(list_reports_with_parts()), 200
 
 
 @app.route('/api/reports/<int:report_id>', methods=['GET'])
@@ -162,10 +692,11 @@ def get_report(report_id):
     report = get_report_with_parts(report_id)
     if not report:
         return jsonify({'error': 'Report not found'}), 404
-    return jsonify(report), 200
+    return set_etag(jsonify(report), report), 200
 
 
 @app.route('/api/reports', methods=['POST'])
+@idempotent
 def create_report():
     """Create a new crash report - Creates with PENDING status, generates incident_id for n8n linking"""
     try:
@@ -187,8 +718,10 @@ def create_report():
             'total': 0.0
         }
 
-        report_response = supabase.table('reports').insert(report_data).execute()
-        report = report_response.data[0]
+        report, created = insert_report_once(report_data)
+        if not created:
+            # Already created for this Idempotency-Key: no parts and no second AI run
+            return replayed_report_response(report, 'Report created successfully. AI processing started.')
         report_id = report['id']
 
         # Add parts if provided
@@ -211,11 +744,11 @@ def create_report():
                 'qty': qty,
                 'total': part_total
             }
-            part_response = supabase.table('parts').insert(part_insert).execute()
+            part_response = get_supabase().table('parts').insert(part_insert).execute()
             created_parts.append(part_to_dict(part_response.data[0]))
 
         # Update report total
-        supabase.table('reports').update({'total': total_amount}).eq('id', report_id).execute()
+        get_supabase().table('reports').update({'total': total_amount}).eq('id', report_id).execute()
         report['total'] = total_amount
 
         # Trigger n8n webhook for AI processing (runs in background)
@@ -240,6 +773,7 @@ def create_report():
 
 
 @app.route('/api/reports/from-n8n', methods=['POST'])
+@idempotent
 def create_report_from_n8n():
     """Create a new crash report from n8n workflow - Sets status as PENDING for review"""
     try:
@@ -259,8 +793,11 @@ def create_report_from_n8n():
             'total': 0.0
         }
 
-        report_response = supabase.table('reports').insert(report_data).execute()
-        report = report_response.data[0]
+        report, created = insert_report_once(report_data)
+        if not created:
+            return replayed_report_response(
+                report, 'Report created successfully and marked as PENDING for review', status='pending'
+            )
         report_id = report['id']
 
         # Add parts if provided
@@ -283,11 +820,11 @@ def create_report_from_n8n():
                 'qty': qty,
                 'total': part_total
             }
-            part_response = supabase.table('parts').insert(part_insert).execute()
+            part_response = get_supabase().table('parts').insert(part_insert).execute()
             created_parts.append(part_to_dict(part_response.data[0]))
 
         # Update report total
-        supabase.table('reports').update({'total': total_amount}).eq('id', report_id).execute()
+        get_supabase().table('reports').update({'total': total_amount}).eq('id', report_id).execute()
         report['total'] = total_amount
 
         return jsonify({
@@ -301,16 +838,78 @@ def create_report_from_n8n():
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+@app.route('/api/reports/ingest', methods=['POST'])
+@idempotent
+def ingest_ai_report():
+    """Ingest raw AI agent output - enriches the report for its incident_id, or creates a PENDING one"""
+    try:
+        payload = request.get_json(silent=True)
+        if payload is None:
+            payload = request.get_data(as_text=True)
+        message = extract_ai_message(payload)
+
+        try:
+            report_data, incident_id = parse_ai_report(message)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Error parsing crash report: {e}'}), 422
+
+        update_data = {
+            'driver': report_data['driver'],
+            'date': report_data['date'],
+            'chassis': report_data['chassis'],
+            'event': report_data['event'],
+            'accident_damage': report_data['accident_damage']
+        }
+
+        result = None
+        if incident_id:
+            # Enrich the report the UI created; the AI has filled in the parts
+            result, error = save_report(
+                incident_id=incident_id, fields={**update_data, 'status': 'active'}, parts=report_data['parts']
+            )
+            # 404: no report for this incident_id yet, so create one below
+            if error and error[1] != 404:
+                return error
+
+        if result:
+            message_text = f'Report {incident_id} enriched from AI output'
+            status_code = 200
+        else:
+            # No matching report - create one as PENDING for review
+            if incident_id:
+                update_data['incident_id'] = incident_id
+            update_data['status'] = 'pending'
+            update_data['total'] = 0.0
+            report_id = get_supabase().table('reports').insert(update_data).execute().data[0]['id']
+
+            # Parts and total in one transaction; if that fails, don't leave an empty
+            # report behind for a retry to duplicate
+            try:
+                result, error = save_report(report_id, parts=report_data['parts'])
+            except Exception:
+                get_supabase().table('reports').delete().eq('id', report_id).execute()
+                raise
+            if error:
+                get_supabase().table('reports').delete().eq('id', report_id).execute()
+                return error
+            message_text = 'Report created from AI output and marked as PENDING for review'
+            status_code = 201
+
+        return jsonify({
+            'success': True,
+            'message': message_text,
+            'incident_id': incident_id,
+            'report': saved_report_to_dict(result)
+        }), status_code
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
 @app.route('/api/reports/pending', methods=['GET'])
 def get_pending_reports():
     """Get all pending reports that need review"""
-    response = supabase.table('reports').select('*').eq('status', 'pending').order('created_at', desc=True).execute()
-    reports = []
-    for report in (response.data or []):
-        parts_response = supabase.table('parts').select('*').eq('report_id', report['id']).execute()
-        parts = [part_to_dict(p) for p in (parts_response.data or [])]
-        reports.append(report_to_dict(report, parts))
-    return jsonify(reports), 200
+    return jsonify(list_reports_with_parts('pending')), 200
 
 
 @app.route('/api/reports/<int:report_id>/status', methods=['PUT'])
@@ -320,27 +919,17 @@ def update_report_status(report_id):
         data = request.json
 
         new_status = data.get('status', '')
-        if new_status not in ['pending', 'active', 'reviewed']:
+        if new_status not in VALID_STATUSES:
             return jsonify({
                 'success': False,
                 'error': 'Invalid status. Must be: pending, active, or reviewed'
             }), 400
 
-        response = supabase.table('reports').update({
-            'status': new_status,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', report_id).execute()
-
-        if not response.data:
-            return jsonify({'success': False, 'error': 'Report not found'}), 404
+        result, error = save_report(report_id, get_if_match_version(), fields={'status': new_status})
+        if error:
+            return error
 
-        report = get_report_with_parts(report_id)
-
-        return jsonify({
-            'success': True,
-            'message': f'Report status updated to {new_status}',
-            'report': report
-        }), 200
+        return report_response(saved_report_to_dict(result), f'Report status updated to {new_status}')
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -352,63 +941,72 @@ def update_report(report_id):
     try:
         data = request.json
 
-        # Build update data
-        update_data = {'updated_at': datetime.utcnow().isoformat()}
-        if 'driver' in data:
-            update_data['driver'] = data['driver']
-        if 'date' in data:
-            update_data['date'] = data['date']
-        if 'chassis' in data:
-            update_data['chassis'] = data['chassis']
-        if 'event' in data:
-            update_data['event'] = data['event']
-        if 'accident_damage' in data:
-            update_data['accident_damage'] = data['accident_damage']
+        fields = {field: data[field] for field in REPORT_FIELDS if field in data}
+        parts = [parse_part(p) for p in data['parts']] if 'parts' in data else None
 
-        # Update parts if provided
-        if 'parts' in data:
-            # Delete existing parts
-            supabase.table('parts').delete().eq('report_id', report_id).execute()
-
-            # Add new parts
-            total_amount = 0.0
-            for part_data in data['parts']:
-                price = float(part_data.get('price', 0) or 0)
-                qty = int(part_data.get('qty', 1) or 1)
-                part_total = price * qty
-                total_amount += part_total
-
-                part_insert = {
-                    'report_id': report_id,
-                    'part_number': part_data.get('part_number', ''),
-                    'part': part_data.get('part', ''),
-                    'likelihood': part_data.get('likelihood', 'Possible'),
-                    'price': price,
-                    'qty': qty,
-                    'total': part_total
-                }
-                supabase.table('parts').insert(part_insert).execute()
-
-            update_data['total'] = total_amount
-
-        response = supabase.table('reports').update(update_data).eq('id', report_id).execute()
+        result, error = save_report(report_id, get_if_match_version(), fields=fields, parts=parts)
+        if error:
+            return error
 
-        if not response.data:
-            return jsonify({'success': False, 'error': 'Report not found'}), 404
+        return report_response(saved_report_to_dict(result), 'Report updated successfully')
 
-        report = get_report_with_parts(report_id)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        return jsonify({
-            'success': True,
-            'message': 'Report updated successfully',
-            'report': report
-        }), 200
+
+@app.route('/api/reports/<int:report_id>', methods=['PATCH'])
+def patch_report(report_id):
+    """Partially update a report with JSON merge-patch semantics (RFC 7396).
+
+    Report fields set to null are cleared. "parts" given as an array replaces the whole
+    parts list; given as an object keyed by part id it is merged into those parts, and a
+    null value deletes that part.
+    """
+    try:
+        patch = request.get_json(force=True)
+        if not isinstance(patch, dict):
+            return jsonify({'success': False, 'error': 'Merge patch must be a JSON object'}), 400
+        if 'status' in patch and patch['status'] not in VALID_STATUSES:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid status. Must be: pending, active, or reviewed'
+            }), 400
+
+        fields = {field: patch[field] or '' for field in REPORT_FIELDS if field in patch}
+        if 'status' in patch:
+            fields['status'] = patch['status']
+
+        parts, part_changes, part_deletes = None, [], []
+        if 'parts' in patch:
+            parts_patch = patch['parts']
+            if parts_patch is None or isinstance(parts_patch, list):
+                parts = [parse_part(p) for p in parts_patch or []]
+            elif isinstance(parts_patch, dict):
+                for part_id, part_patch in parts_patch.items():
+                    if not part_id.isdigit():
+                        raise ValueError(f'Invalid part id: {part_id}')
+                    if part_patch is None:
+                        part_deletes.append(int(part_id))
+                    else:
+                        part_changes.append({'id': int(part_id), **parse_part_fields(part_patch)})
+            else:
+                raise ValueError('parts must be an array or an object keyed by part id')
+
+        result, error = save_report(
+            report_id, get_if_match_version(), fields=fields,
+            parts=parts, part_changes=part_changes, part_deletes=part_deletes
+        )
+        if error:
+            return error
+
+        return report_response(saved_report_to_dict(result), 'Report updated successfully')
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
 @app.route('/api/reports/by-incident/<incident_id>', methods=['PUT'])
+@idempotent
 def update_report_by_incident_id(incident_id):
     """Update an existing report by incident_id - Used by n8n workflow to add parts"""
     try:
@@ -417,74 +1015,29 @@ def update_report_by_incident_id(incident_id):
         if isinstance(data, str):
             data = json.loads(data)
 
-        # Find report by incident_id
-        response = supabase.table('reports').select('*').eq('incident_id', incident_id).execute()
-        if not response.data:
-            return jsonify({
-                'success': False,
-                'error': f'Report with incident_id {incident_id} not found'
-            }), 404
-
-        report = response.data[0]
-        report_id = report['id']
-
-        # Build update data
-        update_data = {'updated_at': datetime.utcnow().isoformat()}
-        if 'driver' in data:
-            update_data['driver'] = data['driver']
-        if 'date' in data:
-            update_data['date'] = data['date']
-        if 'chassis' in data:
-            update_data['chassis'] = data['chassis']
-        if 'event' in data:
-            update_data['event'] = data['event']
-        if 'accident_damage' in data:
-            update_data['accident_damage'] = data['accident_damage']
+        fields = {field: data[field] for field in REPORT_FIELDS if field in data}
 
         # Update parts if provided
+        parts = None
         if 'parts' in data and data['parts']:
-            # Delete existing parts
-            supabase.table('parts').delete().eq('report_id', report_id).execute()
-
-            # Add new parts
-            total_amount = 0.0
             parts_list = data['parts']
 
             # Handle case where parts might be a string (JSON)
             if isinstance(parts_list, str):
                 parts_list = json.loads(parts_list)
 
-            for part_data in parts_list:
-                price = float(part_data.get('price', 0) or 0)
-                qty = int(part_data.get('qty', 1) or 1)
-                part_total = price * qty
-                total_amount += part_total
-
-                part_insert = {
-                    'report_id': report_id,
-                    'part_number': part_data.get('part_number', ''),
-                    'part': part_data.get('part', ''),
-                    'likelihood': part_data.get('likelihood', 'Possible'),
-                    'price': price,
-                    'qty': qty,
-                    'total': part_total
-                }
-                supabase.table('parts').insert(part_insert).execute()
-
-            update_data['total'] = total_amount
+            parts = [normalize_part(p) for p in parts_list]
 
         # Update status to active (n8n has enriched it)
-        update_data['status'] = 'active'
+        fields['status'] = 'active'
 
-        supabase.table('reports').update(update_data).eq('id', report_id).execute()
+        result, error = save_report(
+            if_match=get_if_match_version(), fields=fields, parts=parts, incident_id=incident_id
+        )
+        if error:
+            return error
 
-        report = get_report_with_parts(report_id)
-
-        return jsonify({
-            'success': True,
-            'message': 'Report updated successfully by incident_id',
-            'report': report
-        }), 200
+        return report_response(saved_report_to_dict(result), 'Report updated successfully by incident_id')
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -495,7 +1048,7 @@ def delete_report(report_id):
     """Delete a report"""
     try:
         # Parts will be deleted automatically due to ON DELETE CASCADE
-        response = supabase.table('reports').delete().eq('id', report_id).execute()
+        response = get_supabase().table('reports').delete().eq('id', report_id).execute()
 
         if not response.data:
             return jsonify({'success': False, 'error': 'Report not found'}), 404
@@ -513,43 +1066,18 @@ def delete_report(report_id):
 def add_part(report_id):
     """Add a part to a report"""
     try:
-        # Verify report exists
-        report_response = supabase.table('reports').select('*').eq('id', report_id).single().execute()
-        if not report_response.data:
-            return jsonify({'success': False, 'error': 'Report not found'}), 404
-
-        report = report_response.data
-        data = request.json
-
-        price = float(data.get('price', 0) or 0)
-        qty = int(data.get('qty', 1) or 1)
-        part_total = price * qty
-
-        part_insert = {
-            'report_id': report_id,
-            'part_number': data.get('part_number', ''),
-            'part': data.get('part', ''),
-            'likelihood': data.get('likelihood', 'Possible'),
-            'price': price,
-            'qty': qty,
-            'total': part_total
-        }
+        part = parse_part(request.json)
 
-        part_response = supabase.table('parts').insert(part_insert).execute()
-        part = part_response.data[0]
+        result, error = save_report(report_id, get_if_match_version(), part_changes=[part])
+        if error:
+            return error
 
-        # Update report total
-        new_total = float(report.get('total', 0) or 0) + part_total
-        supabase.table('reports').update({
-            'total': new_total,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', report_id).execute()
-
-        return jsonify({
+        response = jsonify({
             'success': True,
             'message': 'Part added successfully',
-            'part': part_to_dict(part)
-        }), 201
+            'part': part_to_dict(result['changed_parts'][0])
+        })
+        return set_etag(response, result['report']), 201
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -559,97 +1087,194 @@ def add_part(report_id):
 def update_part(part_id):
     """Update a specific part"""
     try:
-        # Get existing part
-        part_response = supabase.table('parts').select('*').eq('id', part_id).single().execute()
-        if not part_response.data:
-            return jsonify({'success': False, 'error': 'Part not found'}), 404
+        part_change = {'id': part_id, **parse_part_fields(request.json)}
 
-        part = part_response.data
-        old_total = float(part.get('total', 0) or 0)
-        report_id = part['report_id']
+        result, error = save_report(if_match=get_if_match_version(), part_changes=[part_change], part_id=part_id)
+        if error:
+            return error
 
-        data = request.json
+        response = jsonify({
+            'success': True,
+            'message': 'Part updated successfully',
+            'part': part_to_dict(result['changed_parts'][0])
+        })
+        return set_etag(response, result['report']), 200
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        # Build update data
-        update_data = {}
-        if 'part_number' in data:
-            update_data['part_number'] = data['part_number']
-        if 'part' in data:
-            update_data['part'] = data['part']
-        if 'likelihood' in data:
-            update_data['likelihood'] = data['likelihood']
 
-        # Get current values for calculation
-        price = float(data.get('price', part.get('price', 0)) or 0)
-        qty = int(data.get('qty', part.get('qty', 1)) or 1)
+@app.route('/api/parts/<int:part_id>', methods=['DELETE'])
+def delete_part(part_id):
+    """Delete a part"""
+    try:
+        result, error = save_report(if_match=get_if_match_version(), part_deletes=[part_id], part_id=part_id)
+        if error:
+            return error
 
-        if 'price' in data:
-            update_data['price'] = price
-        if 'qty' in data:
-            update_data['qty'] = qty
+        response = jsonify({
+            'success': True,
+            'message': 'Part deleted successfully'
+        })
+        return set_etag(response, result['report']), 200
 
-        # Recalculate part total
-        new_part_total = price * qty
-        update_data['total'] = new_part_total
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        supabase.table('parts').update(update_data).eq('id', part_id).execute()
 
-        # Update report total
-        report_response = supabase.table('reports').select('total').eq('id', report_id).single().execute()
-        report_total = float(report_response.data.get('total', 0) or 0)
-        new_report_total = report_total - old_total + new_part_total
+# Archive API Routes (read-only, except for the archival job itself)
 
-        supabase.table('reports').update({
-            'total': new_report_total,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', report_id).execute()
+@app.route('/api/archive/run', methods=['POST'])
+def run_archive():
+    """Archive reviewed reports older than the cutoff (defaults to ARCHIVE_CUTOFF_DAYS).
 
-        # Get updated part
-        updated_part = supabase.table('parts').select('*').eq('id', part_id).single().execute()
+    Moves at most ARCHIVE_MAX_BATCHES_PER_REQUEST batches; call again while 'complete' is
+    false, or use archive_reports.py for a full run.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        cutoff_days = int(data.get('cutoff_days', ARCHIVE_CUTOFF_DAYS))
+        if cutoff_days < 0:
+            return jsonify({'success': False, 'error': 'cutoff_days must not be negative'}), 400
+
+        result = archive_reviewed_reports(cutoff_days, max_batches=ARCHIVE_MAX_BATCHES_PER_REQUEST)
+
+        message = f"Archived {result['archived']} reviewed reports"
+        if not result['complete']:
+            message += '; more remain, run again to continue'
 
         return jsonify({
             'success': True,
-            'message': 'Part updated successfully',
-            'part': part_to_dict(updated_part.data)
+            'message': message,
+            'archived': result['archived'],
+            'cutoff': result['cutoff'],
+            'complete': result['complete']
         }), 200
 
     except Exception as e:
+        if getattr(e, 'code', None) in SCHEMA_ERROR_CODES:
+            return schema_error_response(e)
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
-@app.route('/api/parts/<int:part_id>', methods=['DELETE'])
-def delete_part(part_id):
-    """Delete a part"""
+def get_paging_arg(name, default, minimum):
+    """Integer query parameter >= minimum, or raise ValueError"""
+    raw = request.args.get(name)
+    if raw is None:
+        return default
     try:
-        # Get existing part
-        part_response = supabase.table('parts').select('*').eq('id', part_id).single().execute()
-        if not part_response.data:
-            return jsonify({'success': False, 'error': 'Part not found'}), 404
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if value < minimum:
+        raise ValueError(f'{name} must be at least {minimum}')
+    return value
 
-        part = part_response.data
-        part_total = float(part.get('total', 0) or 0)
-        report_id = part['report_id']
 
-        # Update report total
-        report_response = supabase.table('reports').select('total').eq('id', report_id).single().execute()
-        report_total = float(report_response.data.get('total', 0) or 0)
-        new_report_total = report_total - part_total
+@app.route('/api/archive/reports', methods=['GET'])
+def get_archived_reports():
+    """Get archived reports, newest first (paged with ?limit= and ?offset=)"""
+    try:
+        limit = min(get_paging_arg('limit', 100, 1), 1000)
+        offset = get_paging_arg('offset', 0, 0)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        supabase.table('reports').update({
-            'total': new_report_total,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', report_id).execute()
+    response = get_supabase().table('reports_archive').select('*') \
+        .order('created_at', desc=True).range(offset, offset + limit - 1).execute()
+    return jsonify([archived_report_to_dict(r) for r in (response.data or [])]), 200
 
-        # Delete part
-        supabase.table('parts').delete().eq('id', part_id).execute()
 
-        return jsonify({
-            'success': True,
-            'message': 'Part deleted successfully'
-        }), 200
+@app.route('/api/archive/reports/<int:report_id>', methods=['GET'])
+def get_archived_report(report_id):
+    """Get a specific archived report by ID"""
+    response = get_supabase().table('reports_archive').select('*').eq('id', report_id).execute()
+    if not response.data:
+        return jsonify({'error': 'Archived report not found'}), 404
+    return jsonify(archived_report_to_dict(response.data[0])), 200
 
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+
+EXPORT_COLUMNS = [
+    'report_id', 'incident_id', 'driver', 'date', 'chassis', 'event', 'status',
+    'report_total', 'part_number', 'part', 'likelihood', 'price', 'qty', 'part_total', 'archived'
+]
+
+
+def iter_export_rows(reports, archived):
+    """Yield one CSV row per part (or one row for a report with no parts)"""
+    for report in reports:
+        base = [
+            report['id'], report['incident_id'], report['driver'], report['date'],
+            report['chassis'], report['event'], report['status'], report['total']
+        ]
+        for part in (report['parts'] or [None]):
+            if part is None:
+                yield base + ['', '', '', '', '', '', archived]
+            else:
+                yield base + [
+                    part['part_number'], part['part'], part['likelihood'],
+                    part['price'], part['qty'], part['total'], archived
+                ]
+
+
+def iter_id_pages(table, columns):
+    """Yield a table's rows in pages of ARCHIVE_BATCH_SIZE, by id.
+
+    Keyset paging (id > last id) rather than offsets, so rows deleted mid-stream (e.g. by
+    an archive run) don't shift later pages and make the export skip rows.
+    """
+    last_id = None
+    while True:
+        query = get_supabase().table(table).select(columns).order('id').limit(ARCHIVE_BATCH_SIZE)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        if len(rows) < ARCHIVE_BATCH_SIZE:
+            return
+        last_id = rows[-1]['id']
+
+
+@app.route('/api/reports/export', methods=['GET'])
+def export_reports():
+    """Stream all reports as CSV; pass ?include_archived=true to append cold storage"""
+    include_archived = request.args.get('include_archived', 'false').lower() == 'true'
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush():
+            value = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return value
+
+        writer.writerow(EXPORT_COLUMNS)
+        yield flush()
+
+        for rows in iter_id_pages('reports', '*,parts(*)'):
+            reports = [report_to_dict(r, embedded_parts(r)) for r in rows]
+            for row in iter_export_rows(reports, False):
+                writer.writerow(row)
+            yield flush()
+
+        if include_archived:
+            for rows in iter_id_pages('reports_archive', '*'):
+                for row in iter_export_rows([archived_report_to_dict(r) for r in rows], True):
+                    writer.writerow(row)
+                yield flush()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=vrd_crash_reports.csv'}
+    )
+
+
+record_startup('app (import total)', _process_started)
 
 
 if __name__ == '__main__':
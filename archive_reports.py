@@ -0,0 +1,20 @@
+import sys
+
+from app import ARCHIVE_CUTOFF_DAYS, archive_reviewed_reports
+
+
+def main():
+    cutoff_days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_CUTOFF_DAYS
+
+    print(f"Archiving reviewed reports older than {cutoff_days} days...")
+
+    try:
+        result = archive_reviewed_reports(cutoff_days)
+        print(f"✅ Archived {result['archived']} reports (cutoff {result['cutoff']}).")
+    except Exception as e:
+        print(f"❌ Error archiving reports: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
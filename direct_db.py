@@ -0,0 +1,84 @@
+"""Direct pooled Postgres read path for the hot report queries.
+
+Used instead of PostgREST when READ_BACKEND=postgres. psycopg and psycopg_pool are only
+imported when the pool is first opened, so the default Supabase deployment doesn't pay
+for them at startup.
+"""
+import os
+import threading
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+# One pool per gunicorn worker; size it to the worker's --threads
+PG_POOL_MIN_SIZE = int(os.environ.get('PG_POOL_MIN_SIZE', 1))
+PG_POOL_MAX_SIZE = int(os.environ.get('PG_POOL_MAX_SIZE', 4))
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 10))
+
+# Server-side prepared statements; turn off behind a transaction-mode pooler (pgbouncer)
+PG_PREPARE_STATEMENTS = os.environ.get('PG_PREPARE_STATEMENTS', 'True').lower() == 'true'
+
+# Each report comes back as JSON (as PostgREST would serialise it) with its parts
+# aggregated in, so lists and details are a single query and round trip
+_REPORTS_WITH_PARTS = """
+    SELECT to_json(r) AS report, COALESCE(rp.parts, '[]'::json) AS parts
+    FROM reports r
+    LEFT JOIN LATERAL (
+        SELECT json_agg(p ORDER BY p.id) AS parts
+        FROM parts p
+        WHERE p.report_id = r.id
+    ) rp ON true
+"""
+
+LIST_REPORTS_SQL = _REPORTS_WITH_PARTS + " ORDER BY r.created_at DESC"
+LIST_REPORTS_BY_STATUS_SQL = _REPORTS_WITH_PARTS + " WHERE r.status = %s ORDER BY r.created_at DESC"
+GET_REPORT_SQL = _REPORTS_WITH_PARTS + " WHERE r.id = %s"
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Connection pool for this worker process, opened on first use"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if not DATABASE_URL:
+                    raise RuntimeError('READ_BACKEND=postgres requires DATABASE_URL')
+                from psycopg_pool import ConnectionPool
+
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=PG_POOL_MIN_SIZE,
+                    max_size=PG_POOL_MAX_SIZE,
+                    timeout=PG_POOL_TIMEOUT,
+                    kwargs={
+                        'autocommit': True,
+                        'prepare_threshold': 0 if PG_PREPARE_STATEMENTS else None
+                    },
+                    name='vrd-reads',
+                    open=True
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _report_rows(sql, params=()):
+    """Run a report query; rows are report dicts with their parts embedded"""
+    with get_pool().connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(report, parts=parts) for report, parts in rows]
+
+
+def fetch_reports(status=None):
+    """All reports, newest first (optionally only one status), with parts embedded"""
+    if status:
+        return _report_rows(LIST_REPORTS_BY_STATUS_SQL, (status,))
+    return _report_rows(LIST_REPORTS_SQL)
+
+
+def fetch_report(report_id):
+    """A single report with parts embedded, or None"""
+    rows = _report_rows(GET_REPORT_SQL, (report_id,))
+    return rows[0] if rows else None
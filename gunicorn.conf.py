@@ -0,0 +1,21 @@
+# Gunicorn hooks (picked up automatically from the working directory).
+# Worker count, threads and bind address are set on the command line in the Dockerfile.
+import os
+
+# when_ready runs in the master before any worker is spawned, so importing the client
+# libraries there delays the first /api/health; only do it when asked to
+WARM_UP_IN_MASTER = os.environ.get('WARM_UP_IN_MASTER', 'False').lower() == 'true'
+
+
+def when_ready(server):
+    # With --preload the app is imported once in the master; optionally load the heavy
+    # client libraries there too, so forked workers start with them already imported
+    if server.cfg.preload_app and WARM_UP_IN_MASTER:
+        from app import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    # Build this worker's Supabase client in the background before the first real request needs it
+    from app import init_worker
+    init_worker()
@@ -1,6 +1,8 @@
 // n8n Code Node - Parse AI Agent Output and Extract Crash Report JSON
 // This node extracts the JSON from the AI response and formats it for the dashboard API
 // Also extracts incident_id for the two-step flow (UI creates report, n8n enriches with parts)
+// NOTE: The dashboard can now do this server-side - send the AI Agent output straight to
+// POST /api/reports/ingest and this node (and the follow-up HTTP node) can be removed.
 
 // Get the AI agent's output
 const aiOutput = $input.all();
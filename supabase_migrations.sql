@@ -0,0 +1,205 @@
+-- Schema changes required by the app, on top of the base `reports` and `parts` tables.
+-- Run the whole file in the Supabase SQL editor on every deploy; it is safe to re-run.
+
+-- Report versions: every edit increments it, and the API exposes it as the ETag
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+-- Idempotency-Key of the request that created the report (POST /api/reports and
+-- /api/reports/from-n8n), so a retry that reaches another worker can't insert it twice
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS idempotency_key TEXT UNIQUE;
+
+-- All report and part edits go through save_report, so the version check, the parts
+-- changes and the recomputed total happen in one transaction. The report row is locked
+-- first, which queues concurrent edits of the same report (and its parts) behind each other.
+--
+--   p_report_id         report to edit; or give p_incident_id or p_part_id instead, and the
+--                       report is looked up (and locked) inside the function, in the same
+--                       round trip
+--   p_expected_version  If-Match version, or NULL to apply on top of the latest version
+--   p_fields            report columns to change (driver, date, chassis, event,
+--                       accident_damage, status); other keys are ignored
+--   p_parts             replacement parts list, or NULL to keep the current parts
+--   p_part_changes      parts to update (objects with "id", only the given fields change)
+--                       or insert (objects without "id")
+--   p_part_deletes      ids of parts to delete (JSON array)
+--
+-- Returns {"report": <report row with "parts">, "changed_parts": [...]}, or
+-- {"error": "not_found" | "version_conflict" | "part_not_found", ...} without changing anything.
+DROP FUNCTION IF EXISTS save_report(BIGINT, INTEGER, JSONB, JSONB, JSONB, JSONB);
+CREATE OR REPLACE FUNCTION save_report(
+    p_report_id BIGINT DEFAULT NULL,
+    p_expected_version INTEGER DEFAULT NULL,
+    p_fields JSONB DEFAULT '{}'::JSONB,
+    p_parts JSONB DEFAULT NULL,
+    p_part_changes JSONB DEFAULT '[]'::JSONB,
+    p_part_deletes JSONB DEFAULT '[]'::JSONB,
+    p_incident_id TEXT DEFAULT NULL,
+    p_part_id BIGINT DEFAULT NULL
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_report_id BIGINT;
+    v_version INTEGER;
+    v_missing BIGINT;
+    v_change JSONB;
+    v_part_id BIGINT;
+    v_changed BIGINT[] := '{}';
+    v_report JSONB;
+BEGIN
+    IF p_report_id IS NOT NULL THEN
+        SELECT id, version INTO v_report_id, v_version FROM reports WHERE id = p_report_id FOR UPDATE;
+    ELSIF p_incident_id IS NOT NULL THEN
+        SELECT id, version INTO v_report_id, v_version FROM reports WHERE incident_id = p_incident_id
+        ORDER BY id LIMIT 1 FOR UPDATE;
+    ELSIF p_part_id IS NOT NULL THEN
+        SELECT r.id, r.version INTO v_report_id, v_version FROM reports r
+        WHERE r.id = (SELECT report_id FROM parts WHERE id = p_part_id) FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN jsonb_build_object('error', 'part_not_found', 'part_id', p_part_id);
+        END IF;
+    END IF;
+    IF v_report_id IS NULL THEN
+        RETURN jsonb_build_object('error', 'not_found');
+    END IF;
+    IF p_expected_version IS NOT NULL AND v_version <> p_expected_version THEN
+        RETURN jsonb_build_object('error', 'version_conflict', 'version', v_version);
+    END IF;
+
+    -- Also catches a part deleted or moved between the lookup above and the lock
+    SELECT ids.id INTO v_missing
+    FROM (
+        SELECT (c->>'id')::BIGINT AS id FROM jsonb_array_elements(p_part_changes) c WHERE c ? 'id'
+        UNION ALL
+        SELECT d::BIGINT FROM jsonb_array_elements_text(p_part_deletes) d
+    ) ids
+    WHERE NOT EXISTS (SELECT 1 FROM parts p WHERE p.id = ids.id AND p.report_id = v_report_id)
+    LIMIT 1;
+    IF v_missing IS NOT NULL THEN
+        RETURN jsonb_build_object('error', 'part_not_found', 'part_id', v_missing);
+    END IF;
+
+    IF p_parts IS NOT NULL THEN
+        DELETE FROM parts WHERE report_id = v_report_id;
+        INSERT INTO parts (report_id, part_number, part, likelihood, price, qty, total)
+        SELECT v_report_id, x.part_number, x.part, x.likelihood, x.price, x.qty, x.price * x.qty
+        FROM jsonb_populate_recordset(NULL::parts, p_parts) x;
+    END IF;
+
+    DELETE FROM parts WHERE id IN (SELECT d::BIGINT FROM jsonb_array_elements_text(p_part_deletes) d);
+
+    FOR v_change IN SELECT * FROM jsonb_array_elements(p_part_changes) LOOP
+        IF v_change ? 'id' THEN
+            UPDATE parts p SET (part_number, part, likelihood, price, qty) = (
+                SELECT x.part_number, x.part, x.likelihood, x.price, x.qty
+                FROM jsonb_populate_record(p, v_change - 'id' - 'report_id') x
+            )
+            WHERE p.id = (v_change->>'id')::BIGINT
+            RETURNING p.id INTO v_part_id;
+            UPDATE parts SET total = price * qty WHERE id = v_part_id;
+        ELSE
+            INSERT INTO parts (report_id, part_number, part, likelihood, price, qty, total)
+            SELECT v_report_id, x.part_number, x.part, x.likelihood, x.price, x.qty, x.price * x.qty
+            FROM jsonb_populate_record(NULL::parts, v_change) x
+            RETURNING id INTO v_part_id;
+        END IF;
+        v_changed := v_changed || v_part_id;
+    END LOOP;
+
+    UPDATE reports r SET
+        (driver, date, chassis, event, accident_damage, status) = (
+            SELECT x.driver, x.date, x.chassis, x.event, x.accident_damage, x.status
+            FROM jsonb_populate_record(r, p_fields - 'id' - 'version') x
+        ),
+        total = (SELECT COALESCE(SUM(p.total), 0) FROM parts p WHERE p.report_id = r.id),
+        version = r.version + 1,
+        updated_at = NOW()
+    WHERE r.id = v_report_id;
+
+    SELECT to_jsonb(r) || jsonb_build_object('parts', COALESCE(
+        (SELECT jsonb_agg(p ORDER BY p.id) FROM parts p WHERE p.report_id = r.id), '[]'::JSONB
+    ))
+    INTO v_report
+    FROM reports r WHERE r.id = v_report_id;
+
+    RETURN jsonb_build_object(
+        'report', v_report,
+        'changed_parts', COALESCE(
+            (SELECT jsonb_agg(p ORDER BY p.id) FROM parts p WHERE p.id = ANY(v_changed)), '[]'::JSONB
+        )
+    );
+END;
+$$;
+
+-- Cold storage for reviewed reports, with their parts stored inline
+CREATE TABLE IF NOT EXISTS reports_archive (
+    id BIGINT PRIMARY KEY,
+    incident_id TEXT,
+    driver TEXT,
+    date TEXT,
+    chassis TEXT,
+    event TEXT,
+    accident_damage TEXT,
+    total NUMERIC,
+    status TEXT,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ,
+    version INTEGER,
+    archived_at TIMESTAMPTZ DEFAULT NOW(),
+    parts JSONB NOT NULL DEFAULT '[]'
+);
+-- Postgres only compresses values in rows over about 2 KB (fixed at build time; lowering
+-- toast_tuple_target does not change it), so a typical archived report is stored as is.
+-- lz4 is just the faster codec for the few that are that large (many parts, long damage text).
+ALTER TABLE reports_archive ALTER COLUMN parts SET COMPRESSION lz4;
+ALTER TABLE reports_archive ALTER COLUMN accident_damage SET COMPRESSION lz4;
+CREATE INDEX IF NOT EXISTS reports_archive_created_at_idx ON reports_archive (created_at DESC);
+
+-- Moves one batch of reviewed reports older than p_cutoff into reports_archive and returns
+-- how many were moved. The copy and the delete are one statement on the same snapshot, and
+-- the rows are locked first (skipping any being edited), so a report whose status or parts
+-- change concurrently is either archived as it is after the edit or left alone; it is never
+-- deleted with a stale archive copy. Parts go with their report via ON DELETE CASCADE.
+CREATE OR REPLACE FUNCTION archive_reviewed_reports(
+    p_cutoff TIMESTAMPTZ,
+    p_limit INTEGER
+) RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_moved INTEGER;
+BEGIN
+    WITH batch AS (
+        SELECT id FROM reports
+        WHERE status = 'reviewed' AND created_at < p_cutoff
+        ORDER BY id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM reports r USING batch
+        WHERE r.id = batch.id AND r.status = 'reviewed'
+        RETURNING r.*
+    )
+    INSERT INTO reports_archive (
+        id, incident_id, driver, date, chassis, event, accident_damage, total, status,
+        created_at, updated_at, version, archived_at, parts
+    )
+    SELECT m.id, m.incident_id, m.driver, m.date, m.chassis, m.event, m.accident_damage, m.total,
+        m.status, m.created_at, m.updated_at, m.version, NOW(), COALESCE(
+            (SELECT jsonb_agg(p ORDER BY p.id) FROM parts p WHERE p.report_id = m.id), '[]'::JSONB
+        )
+    FROM moved m
+    ON CONFLICT (id) DO UPDATE SET
+        (incident_id, driver, date, chassis, event, accident_damage, total, status,
+         created_at, updated_at, version, archived_at, parts) =
+        (EXCLUDED.incident_id, EXCLUDED.driver, EXCLUDED.date, EXCLUDED.chassis, EXCLUDED.event,
+         EXCLUDED.accident_damage, EXCLUDED.total, EXCLUDED.status, EXCLUDED.created_at,
+         EXCLUDED.updated_at, EXCLUDED.version, EXCLUDED.archived_at, EXCLUDED.parts);
+
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+    RETURN v_moved;
+END;
+$$;
+
+-- Make PostgREST pick up the new column and functions
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,81 @@
+import json
+import sys
+
+from app import extract_ai_message, parse_ai_report
+
+# Checks the server-side AI output parser used by POST /api/reports/ingest.
+# Needs no server or database: python verify_ai_parser.py
+
+REPORT = {
+    "driver": "Verification Bot",
+    "date": "2025-11-18",
+    "event": "Integration Test",
+    "parts": [
+        {"part_number": "TEST-001", "part": "Front wing", "likelihood": "Likely", "price": "123.45", "qty": "2"},
+        {"part": "Nose cone", "price": None, "qty": "lots"}
+    ]
+}
+
+
+def message(report, prefix='Report for VRD-20251118-ABC123. '):
+    body = report if isinstance(report, str) else json.dumps(report)
+    return f"{prefix}###JSON_START###\n{body}\n###JSON_END###\nDone."
+
+
+def check(name, condition):
+    print(f"{'✅' if condition else '❌'} {name}")
+    return condition
+
+
+def rejects(name, raw_message):
+    try:
+        parse_ai_report(raw_message)
+    except ValueError as e:
+        return check(f"{name} rejected ({e})", True)
+    return check(f"{name} rejected", False)
+
+
+def verify_ai_parser():
+    ok = True
+
+    report, incident_id = parse_ai_report(message(REPORT))
+    ok &= check("incident_id found in message text", incident_id == 'VRD-20251118-ABC123')
+    ok &= check("optional fields defaulted", report['chassis'] == '' and report['accident_damage'] == '')
+    ok &= check("part price/qty coerced", report['parts'][0]['price'] == 123.45 and report['parts'][0]['qty'] == 2)
+    ok &= check("bad part price/qty defaulted", report['parts'][1]['price'] == 0.0 and report['parts'][1]['qty'] == 1)
+    ok &= check("missing part fields defaulted", report['parts'][1]['likelihood'] == 'Possible')
+
+    _, incident_id = parse_ai_report(message(dict(REPORT, incident_id='vrd-20251118-fff000')))
+    ok &= check("incident_id from JSON wins, upper-cased", incident_id == 'VRD-20251118-FFF000')
+
+    _, incident_id = parse_ai_report(message(REPORT, prefix=''))
+    ok &= check("no incident_id is allowed", incident_id is None)
+
+    report, _ = parse_ai_report(message(json.dumps(json.dumps(REPORT))))
+    ok &= check("double-encoded report JSON accepted", report['driver'] == 'Verification Bot')
+
+    report, _ = parse_ai_report(message(dict(REPORT, parts=json.dumps(REPORT['parts']))))
+    ok &= check("parts as a JSON string accepted", len(report['parts']) == 2)
+
+    ok &= rejects("missing markers", "The AI is still asking questions")
+    ok &= rejects("invalid JSON", message("{not json"))
+    ok &= rejects("non-object report", message("[1, 2]"))
+    ok &= rejects("missing driver", message(dict(REPORT, driver='')))
+    ok &= rejects("parts as an object", message(dict(REPORT, parts={"a": 1})))
+    ok &= rejects("parts with non-objects", message(dict(REPORT, parts=["x"])))
+    ok &= rejects("numeric incident_id", message(dict(REPORT, incident_id=123)))
+
+    text = message(REPORT)
+    ok &= check("message from n8n item list", extract_ai_message([{"json": {"output": text}}]) == text)
+    ok &= check("message from plain object", extract_ai_message({"text": text}) == text)
+    ok &= check("message from raw text body", extract_ai_message(text) == text)
+    ok &= check("n8n item with string json", extract_ai_message({"json": "str"}) == "str")
+    ok &= check("bare JSON number body", extract_ai_message(5) == "5")
+    ok &= rejects("bare JSON number body", extract_ai_message(5))
+    ok &= check("empty body", extract_ai_message(None) == '')
+
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_ai_parser() else 1)